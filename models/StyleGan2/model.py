@@ -1,27 +1,22 @@
+import contextlib
 import math
 import random
 import torch
 from torch import nn
 from torch.nn import functional as F
 
-from .op.fused_act import FusedLeakyReLU, fused_leaky_relu
+from .op.fused_act import FusedLeakyReLU, fused_leaky_relu, fused_noise_leaky_relu, is_compiling
+from .op.fused_modulate import fused_modulate
 from .op.upfirdn2d import upfirdn2d
 
 
-class Squeeze(nn.Module):
-    def __init__(self, *args, **kwargs):
-        super(Squeeze, self).__init__()
+@torch.jit.script
+def pixel_norm(input, eps: float = 1e-8):
+    # reduce in fp32 for half inputs, scripted so the fuser can merge the elementwise ops
+    x = input.float()
+    norm = torch.rsqrt((x * x).mean(1, keepdim=True) + eps)
 
-    def forward(self, input):
-        return torch.squeeze(input)
-
-
-class Reshape(nn.Module):
-    def __init__(self, *args, **kwargs):
-        super(Reshape, self).__init__()
-
-    def forward(self, input):
-        return input.view(input.shape[0], -1)
+    return input * norm.to(input.dtype)
 
 
 class PixelNorm(nn.Module):
@@ -29,7 +24,7 @@ class PixelNorm(nn.Module):
         super().__init__()
 
     def forward(self, input):
-        return input * torch.rsqrt(torch.mean(input ** 2, dim=1, keepdim=True) + 1e-8)
+        return pixel_norm(input)
 
 
 def make_kernel(k):
@@ -43,6 +38,73 @@ def make_kernel(k):
     return k
 
 
+def compile_for_inference(module, mode='reduce-overhead'):
+    """Switch `module` to eval mode and wrap its forward in torch.compile
+    (Inductor), which fuses the small elementwise chains (noise/bias/lrelu,
+    PixelNorm, minibatch stddev). The first call for each input shape pays
+    the compile time. Used as a method by Generator and Discriminator.
+    """
+    if not hasattr(torch, 'compile'):
+        raise RuntimeError('compile_for_inference needs torch >= 2.0')
+
+    module.eval()
+    # fullgraph=False: Python-side branches (e.g. random style mixing) become graph breaks
+    module.forward = torch.compile(module.forward, mode=mode, dynamic=False, fullgraph=False)
+
+    return module
+
+
+class CachedParamsMixin:
+    """Caches tensors derived from a parameter, e.g. the equalized-lr scaled weight.
+
+    An entry is reused while its source tensor is unchanged (same storage,
+    version counter, device and dtype), and the cache is cleared by
+    load_state_dict, .to()/.half() and train()/eval(). Writes through
+    `param.data` (e.g. an EMA update or init_weights) bypass the version
+    counter, so call `clear_param_cache()` or eval() after them. Nothing is
+    cached while autograd records through the source or while tracing or
+    compiling, so gradients are unaffected and graphs keep the weight computation.
+    """
+
+    def clear_param_cache(self):
+        self.__dict__.pop('_param_cache', None)
+
+    def train(self, mode=True):
+        self.clear_param_cache()
+
+        return super().train(mode)
+
+    def _apply(self, *args, **kwargs):
+        self.clear_param_cache()
+
+        return super()._apply(*args, **kwargs)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.clear_param_cache()
+
+        return super()._load_from_state_dict(*args, **kwargs)
+
+    def cached(self, name, source, fn):
+        grad_enabled = torch.is_grad_enabled()
+
+        if (grad_enabled and source.requires_grad) or torch.jit.is_tracing() or is_compiling():
+            return fn()
+
+        key = (source.data_ptr(), source._version, source.device, source.dtype)
+        cache = self.__dict__.setdefault('_param_cache', {})
+        entry = cache.get(name)
+
+        # tensors made under inference_mode cannot be saved for a later backward
+        if entry is not None and entry[0] == key:
+            if not (grad_enabled and getattr(entry[1], 'is_inference', lambda: False)()):
+                return entry[1]
+
+        value = fn()
+        cache[name] = (key, value)
+
+        return value
+
+
 class Upsample(nn.Module):
     def __init__(self, kernel, factor=2):
         super().__init__()
@@ -104,7 +166,7 @@ class Blur(nn.Module):
         return out
 
 
-class EqualConv2d(nn.Module):
+class EqualConv2d(CachedParamsMixin, nn.Module):
     def __init__(
             self, in_channel, out_channel, kernel_size, stride=1, padding=0, bias=True
     ):
@@ -124,10 +186,13 @@ class EqualConv2d(nn.Module):
         else:
             self.bias = None
 
+    def scaled_weight(self):
+        return self.cached('weight', self.weight, lambda: self.weight * self.scale)
+
     def forward(self, input):
         out = F.conv2d(
             input,
-            self.weight * self.scale,
+            self.scaled_weight(),
             bias=self.bias,
             stride=self.stride,
             padding=self.padding,
@@ -142,7 +207,7 @@ class EqualConv2d(nn.Module):
         )
 
 
-class EqualLinear(nn.Module):
+class EqualLinear(CachedParamsMixin, nn.Module):
     def __init__(
             self, in_dim, out_dim, bias=True, bias_init=0, lr_mul=1, activation=None
     ):
@@ -161,15 +226,25 @@ class EqualLinear(nn.Module):
         self.scale = (1 / math.sqrt(in_dim)) * lr_mul
         self.lr_mul = lr_mul
 
+    def scaled_params(self):
+        weight = self.cached('weight', self.weight, lambda: self.weight * self.scale)
+
+        if self.bias is None:
+            return weight, None
+
+        bias = self.cached('bias', self.bias, lambda: self.bias * self.lr_mul)
+
+        return weight, bias
+
     def forward(self, input):
+        weight, bias = self.scaled_params()
+
         if self.activation:
-            out = F.linear(input, self.weight * self.scale)
-            out = fused_leaky_relu(out, self.bias * self.lr_mul)
+            out = F.linear(input, weight)
+            out = fused_leaky_relu(out, bias)
 
         else:
-            out = F.linear(
-                input, self.weight * self.scale, bias=self.bias * self.lr_mul
-            )
+            out = F.linear(input, weight, bias=bias)
 
         return out
 
@@ -180,18 +255,24 @@ class EqualLinear(nn.Module):
 
 
 class ScaledLeakyReLU(nn.Module):
-    def __init__(self, negative_slope=0.2):
+    def __init__(self, negative_slope=0.2, inplace=False):
         super().__init__()
 
         self.negative_slope = negative_slope
+        self.inplace = inplace
 
     def forward(self, input):
+        if self.inplace:
+            # lrelu(x) * s == lrelu(x * s) for s > 0; scaling first keeps the result
+            # saved by leaky_relu_ for backward unmodified
+            return F.leaky_relu_(input.mul_(math.sqrt(2)), negative_slope=self.negative_slope)
+
         out = F.leaky_relu(input, negative_slope=self.negative_slope)
 
-        return out * math.sqrt(2)
+        return out.mul_(math.sqrt(2))
 
 
-class ModulatedConv2d(nn.Module):
+class ModulatedConv2d(CachedParamsMixin, nn.Module):
     def __init__(
             self,
             in_channel,
@@ -240,6 +321,9 @@ class ModulatedConv2d(nn.Module):
 
         self.demodulate = demodulate
 
+    def scaled_weight(self):
+        return self.cached('weight', self.weight, lambda: self.scale * self.weight)
+
     def __repr__(self):
         return (
             f'{self.__class__.__name__}({self.in_channel}, {self.out_channel}, {self.kernel_size}, '
@@ -249,25 +333,21 @@ class ModulatedConv2d(nn.Module):
     def forward(self, input, style):
         batch, in_channel, height, width = input.shape
 
-        style = self.modulation(style).view(batch, 1, in_channel, 1, 1)
-        weight = self.scale * self.weight * style
+        style = self.modulation(style)
 
-        if self.demodulate:
-            demod = torch.rsqrt(weight.pow(2).sum([2, 3, 4]) + 1e-8)
-            weight = weight * demod.view(batch, self.out_channel, 1, 1, 1)
+        if not self.demodulate and self.kernel_size == 1 and not (self.upsample or self.downsample):
+            # modulate the input instead of the weight, leaving a plain shared 1x1 conv
+            input = input * style.view(batch, in_channel, 1, 1)
 
-        weight = weight.view(
-            batch * self.out_channel, in_channel, self.kernel_size, self.kernel_size
+            return F.conv2d(input, self.scaled_weight().squeeze(0))
+
+        # upsampling needs the [batch * in, out, k, k] conv_transpose2d layout
+        weight = fused_modulate(
+            self.scaled_weight(), style, 1, self.demodulate, transpose=self.upsample
         )
 
         if self.upsample:
-            input = input.view(1, batch * in_channel, height, width)
-            weight = weight.view(
-                batch, self.out_channel, in_channel, self.kernel_size, self.kernel_size
-            )
-            weight = weight.transpose(1, 2).reshape(
-                batch * in_channel, self.out_channel, self.kernel_size, self.kernel_size
-            )
+            input = input.reshape(1, batch * in_channel, height, width)
             out = F.conv_transpose2d(input, weight, padding=0, stride=2, groups=batch)
             _, _, height, width = out.shape
             out = out.view(batch, self.out_channel, height, width)
@@ -276,13 +356,22 @@ class ModulatedConv2d(nn.Module):
         elif self.downsample:
             input = self.blur(input)
             _, _, height, width = input.shape
-            input = input.view(1, batch * in_channel, height, width)
+            input = input.reshape(1, batch * in_channel, height, width)
             out = F.conv2d(input, weight, padding=0, stride=2, groups=batch)
             _, _, height, width = out.shape
             out = out.view(batch, self.out_channel, height, width)
 
+        elif height * width <= 32 * 32 and not (
+            torch.is_grad_enabled() and (input.requires_grad or weight.requires_grad)
+        ):
+            # grouped conv with tiny groups is slow on small maps, im2col + bmm is not;
+            # only without autograd, which would keep the k*k larger cols for backward
+            cols = F.unfold(input, self.kernel_size, padding=self.padding)
+            weight = weight.view(batch, self.out_channel, -1)
+            out = torch.bmm(weight, cols).view(batch, self.out_channel, height, width)
+
         else:
-            input = input.view(1, batch * in_channel, height, width)
+            input = input.reshape(1, batch * in_channel, height, width)
             out = F.conv2d(input, weight, padding=self.padding, groups=batch)
             _, _, height, width = out.shape
             out = out.view(batch, self.out_channel, height, width)
@@ -295,13 +384,39 @@ class NoiseInjection(nn.Module):
         super().__init__()
 
         self.weight = nn.Parameter(torch.zeros(1))
+        self.register_buffer('_noise_cache', None, persistent=False)
 
-    def forward(self, image, noise=None):
+    def get_noise(self, image, noise=None):
         if noise is None:
             batch, _, height, width = image.shape
-            noise = image.new_empty(batch, 1, height, width).normal_()
 
-        return image + self.weight * noise
+            if (
+                (torch.is_grad_enabled() and self.weight.requires_grad)
+                or torch.jit.is_tracing()
+                or is_compiling()
+            ):
+                # autograd saves the noise for the weight gradient, it must not be
+                # overwritten; traced/compiled graphs must not capture the buffer
+                return image.new_empty(batch, 1, height, width).normal_()
+
+            cache = self._noise_cache
+
+            if (
+                cache is None
+                or cache.shape[0] < batch
+                or cache.shape[2:] != image.shape[2:]
+                or cache.dtype != image.dtype
+                or cache.device != image.device
+            ):
+                cache = image.new_empty(batch, 1, height, width)
+                self._noise_cache = cache
+
+            noise = cache[:batch].normal_()
+
+        return noise
+
+    def forward(self, image, noise=None):
+        return image + self.weight * self.get_noise(image, noise)
 
 
 class ConstantInput(nn.Module):
@@ -312,7 +427,8 @@ class ConstantInput(nn.Module):
 
     def forward(self, input):
         batch = input.shape[0]
-        out = self.input.repeat(batch, 1, 1, 1)
+        # stride-0 view, the modulated conv reads it as is (or copies via reshape)
+        out = self.input.expand(batch, -1, -1, -1)
 
         return out
 
@@ -347,9 +463,15 @@ class StyledConv(nn.Module):
 
     def forward(self, input, style, noise=None):
         out = self.conv(input, style)
-        out = self.noise(out, noise=noise)
-        # out = out + self.bias
-        out = self.activate(out)
+        # noise injection, bias and activation in one pass
+        out = fused_noise_leaky_relu(
+            out,
+            self.noise.get_noise(out, noise),
+            self.noise.weight,
+            self.activate.bias,
+            self.activate.negative_slope,
+            self.activate.scale,
+        )
 
         return out
 
@@ -385,12 +507,19 @@ class Generator(nn.Module):
         channel_multiplier=2,
         blur_kernel=[1, 3, 3, 1],
         lr_mlp=0.01,
+        amp_dtype=None,
     ):
+        """
+        amp_dtype: if set (e.g. torch.bfloat16), the mapping network and the
+        synthesis blocks run under CUDA autocast with that dtype; the image
+        is returned in fp32. Needs torch >= 1.10.
+        """
         super().__init__()
 
         self.size = size
 
         self.style_dim = style_dim
+        self.amp_dtype = amp_dtype
 
         layers = [PixelNorm()]
 
@@ -465,6 +594,11 @@ class Generator(nn.Module):
     def get_last_layer(self):
         return [self.to_rgbs[-1].conv.weight, self.convs[-1].conv.weight]
 
+    def fixed_noise(self):
+        # buffers are kept in registration order, i.e. noise_0 ... noise_{num_layers - 1};
+        # read them from the module each time so .to()/.cuda() are picked up
+        return list(self.noises.buffers())
+
     def make_noise(self):
         device = self.input.input.device
 
@@ -503,105 +637,155 @@ class Generator(nn.Module):
         noise=None,
         randomize_noise=True,
     ):
-        if not input_is_latent:
-            styles = [self.get_latent(s) for s in styles]
-        if noise is None:
-            if randomize_noise:
-                noise = [None] * self.num_layers
-            else:
-                noise = [getattr(self.noises, f"noise_{i}") for i in range(self.num_layers)]
-        if truncation < 1:
-            style_t = []
-            for style in styles:
-                style_t.append(truncation_latent + truncation * (style - truncation_latent))
-            styles = style_t
-        if len(styles) < 2:  # no mixing
-            inject_index = self.n_latent
-            if styles[0].ndim < 3:  # w is of dim [batch, 512], repeat at dim 1 for each block
-                if styles[0].shape[1] == self.style_dim:
-                    latent = styles[0].unsqueeze(1).repeat(1, inject_index, 1)
-                else:
-                    latent = styles[0].view(styles[0].shape[0], -1, self.style_dim)
-            else:  # w is of dim [batch, n_latent, 512]
-                latent = styles[0]
-        else:  # mixing
-            if inject_index is None:
-                inject_index = random.randint(1, self.n_latent - 1)
-            latent = styles[0].unsqueeze(1).repeat(1, inject_index, 1)
-            latent2 = styles[1].unsqueeze(1).repeat(1, self.n_latent - inject_index, 1)
-            latent = torch.cat([latent, latent2], 1)
-        return latent
+        styles = self.prepare_styles(styles, truncation, truncation_latent, input_is_latent)
 
-    def forward(
+        return self.styles_to_latent(styles, inject_index)
+
+    def prepare_styles(
         self,
         styles,
-        return_latents=False,
-        inject_index=None,
         truncation=1,
         truncation_latent=None,
         input_is_latent=False,
-        noise=None,
-        randomize_noise=True,
         detach_style=False,
     ):
         if not input_is_latent:  # if `style' is z, then get w = self.style(z)
-            styles = [self.get_latent(s, detach=detach_style) for s in styles]
-
-        if noise is None:
-            if randomize_noise:
-                noise = [None] * self.num_layers
-            else:
-                noise = [
-                    getattr(self.noises, f"noise_{i}") for i in range(self.num_layers)
-                ]
+            with self.autocast():
+                styles = [self.get_latent(s, detach=detach_style) for s in styles]
 
         if truncation < 1:
-            style_t = []
+            styles = [
+                truncation_latent + truncation * (style - truncation_latent) for style in styles
+            ]
 
-            for style in styles:
-                style_t.append(
-                    truncation_latent + truncation * (style - truncation_latent)
-                )
+        return styles
+
+    def single_latent(self, style):
+        if style.ndim < 3:
+            if style.shape[1] == self.style_dim:  # w is [batch, 512], expand for each block
+                return style.unsqueeze(1).expand(-1, self.n_latent, -1)
 
-            styles = style_t
+            return style.view(style.shape[0], -1, self.style_dim)  # flattened w+
 
+        return style  # w is of dim [batch, n_latent, 512]
+
+    def mixed_latent(self, style0, style1, inject_index):
+        return torch.cat(
+            [
+                style0.unsqueeze(1).expand(-1, inject_index, -1),
+                style1.unsqueeze(1).expand(-1, self.n_latent - inject_index, -1),
+            ],
+            1,
+        )
+
+    def styles_to_latent(self, styles, inject_index=None):
         if len(styles) < 2:  # no mixing
-            inject_index = self.n_latent
+            return self.single_latent(styles[0])
 
-            if styles[0].ndim < 3:  # w is of dim [batch, 512], repeat at dim 1 for each block
-                if styles[0].shape[1] == self.style_dim:
-                    latent = styles[0].unsqueeze(1).repeat(1, inject_index, 1)
-                else:
-                    latent = styles[0].view(styles[0].shape[0], -1, self.style_dim)
+        if inject_index is None:
+            inject_index = random.randint(1, self.n_latent - 1)
 
-            else:  # w is of dim [batch, n_latent, 512]
-                latent = styles[0]
+        return self.mixed_latent(styles[0], styles[1], inject_index)
 
-        else:  # mixing
-            if inject_index is None:
-                inject_index = random.randint(1, self.n_latent - 1)
+    def autocast(self):
+        if self.amp_dtype is None or not self.input.input.is_cuda:
+            return contextlib.nullcontext()
+
+        return torch.autocast('cuda', dtype=self.amp_dtype)
 
-            latent = styles[0].unsqueeze(1).repeat(1, inject_index, 1)
-            latent2 = styles[1].unsqueeze(1).repeat(1, self.n_latent - inject_index, 1)
+    def synthesis(self, latent, noise=None):
+        """Run the synthesis blocks on a [batch, n_latent, style_dim] latent.
 
-            latent = torch.cat([latent, latent2], 1)
+        Only tensors and integer-indexed module lists are used here so that
+        the loop can be traced, see `jit_compile`.
+        """
+        if noise is None:
+            noise = [None] * self.num_layers
 
         out = self.input(latent)  # only batch_size of latent is used
         out = self.conv1(out, latent[:, 0], noise=noise[0])
 
         skip = self.to_rgb1(out, latent[:, 1])
 
-        i = 1
-        for conv1, conv2, noise1, noise2, to_rgb in zip(
-            self.convs[::2], self.convs[1::2], noise[1::2], noise[2::2], self.to_rgbs
-        ):
-            out = conv1(out, latent[:, i], noise=noise1)
-            out = conv2(out, latent[:, i + 1], noise=noise2)
-            skip = to_rgb(out, latent[:, i + 2], skip)
+        for i in range(len(self.to_rgbs)):
+            out = self.convs[2 * i](out, latent[:, 2 * i + 1], noise=noise[2 * i + 1])
+            out = self.convs[2 * i + 1](out, latent[:, 2 * i + 2], noise=noise[2 * i + 2])
+            skip = self.to_rgbs[i](out, latent[:, 2 * i + 3], skip)
+
+        return skip
+
+    def jit_compile(self, latent):
+        """Trace `synthesis` for the shape/device of `latent` and return the
+        TorchScript module; call `.synthesis(latent)` on it for inference.
+
+        Tracing (rather than scripting) is used because the style handling in
+        `forward` is Python-level and the custom CUDA ops are not TorchScript
+        ops; while tracing they fall back to their native implementation.
+        Noise is resampled on every call of the traced module.
+        """
+        with torch.no_grad():
+            return torch.jit.trace_module(self, {'synthesis': (latent,)})
+
+    def _synthesis(self, latent, noise):
+        with self.autocast():
+            image = self.synthesis(latent, noise)
+
+        if self.amp_dtype is not None:
+            image = image.float()
+
+        return image
+
+    compile_for_inference = compile_for_inference
+
+    def forward_single(self, latent, noise=None):
+        """Generate from one w ([batch, 512]), or w+ ([batch, n_latent, 512] or
+        flattened to [batch, n_latent * 512]). Returns (image, latent).
+
+        The branches only depend on shapes, so this can be traced once per
+        input layout.
+        """
+        latent = self.single_latent(latent)
+
+        return self._synthesis(latent, noise), latent
+
+    def forward_mixed(self, latent0, latent1, inject_index, noise=None):
+        """Style mixing: w latent0 feeds the first `inject_index` layers and
+        latent1 the rest. Returns (image, latent).
+        """
+        latent = self.mixed_latent(latent0, latent1, inject_index)
+
+        return self._synthesis(latent, noise), latent
 
-            i += 2
+    def forward(
+        self,
+        styles,
+        return_latents=False,
+        inject_index=None,
+        truncation=1,
+        truncation_latent=None,
+        input_is_latent=False,
+        noise=None,
+        randomize_noise=True,
+        detach_style=False,
+    ):
+        styles = self.prepare_styles(
+            styles, truncation, truncation_latent, input_is_latent, detach_style
+        )
+
+        if noise is None:
+            if randomize_noise:
+                noise = [None] * self.num_layers
+            else:
+                noise = self.fixed_noise()
+
+        if len(styles) < 2:  # no mixing
+            image, latent = self.forward_single(styles[0], noise)
+
+        else:
+            if inject_index is None:
+                inject_index = random.randint(1, self.n_latent - 1)
 
-        image = skip
+            image, latent = self.forward_mixed(styles[0], styles[1], inject_index, noise)
 
         if return_latents:
             return image, latent
@@ -659,6 +843,19 @@ class ConvLayer(nn.Sequential):
         super().__init__(*layers)
 
 
+@torch.jit.script
+def minibatch_stddev(out, group: int, feat: int):
+    # append the minibatch stddev feature maps, scripted so the reductions and
+    # elementwise ops are fused
+    batch, channel, height, width = out.shape
+    stddev = out.view(group, -1, feat, channel // feat, height, width)
+    stddev = torch.sqrt(stddev.var(0, unbiased=False) + 1e-8)
+    stddev = stddev.mean([2, 3, 4], keepdim=True).squeeze(2)
+    stddev = stddev.repeat(group, 1, height, width)
+
+    return torch.cat([out, stddev], 1)
+
+
 class ResBlock(nn.Module):
     def __init__(self, in_channel, out_channel, blur_kernel=[1, 3, 3, 1], architecture='resnet'):
         super().__init__()
@@ -673,13 +870,18 @@ class ResBlock(nn.Module):
                 in_channel, out_channel, 1, downsample=True, activate=False, bias=False
             )
 
+            # fold the (out + skip) / sqrt(2) of the residual sum into both branches,
+            # leaky relu is positively homogeneous so scaling its output is exact
+            self.conv2[-1].scale /= math.sqrt(2)
+            self.skip[-1].scale /= math.sqrt(2)
+
     def forward(self, input):
         out = self.conv1(input)
         out = self.conv2(out)
 
         if self.architecture == 'resnet':
             skip = self.skip(input)
-            out = (out + skip) / math.sqrt(2)
+            out = out + skip
 
         return out
 
@@ -803,18 +1005,18 @@ class Discriminator(nn.Module):
         self.final_conv = ConvLayer(in_channel + 1, channels[4], 3)
         if self.which_phi == 'lin1':
             self.final_linear = nn.Sequential(
-                Reshape(),
+                nn.Flatten(1),
                 EqualLinear(channels[4] * 4 * 4, 1)
             )
         elif self.which_phi == 'lin2':
             self.final_linear = nn.Sequential(
-                Reshape(),
+                nn.Flatten(1),
                 EqualLinear(channels[4] * 4 * 4, channels[4], activation="fused_lrelu"),
                 EqualLinear(channels[4], 1)
             )
         elif self.which_phi == 'lin4':
             self.final_linear = nn.Sequential(
-                Reshape(),
+                nn.Flatten(1),
                 EqualLinear(channels[4] * 4 * 4, channels[4], activation="fused_lrelu"),
                 EqualLinear(channels[4], channels[4], activation="fused_lrelu"),
                 EqualLinear(channels[4], channels[4], activation="fused_lrelu"),
@@ -823,29 +1025,24 @@ class Discriminator(nn.Module):
         elif self.which_phi == 'avg1':
             self.final_linear = nn.Sequential(
                 nn.AvgPool2d(4),
-                Squeeze(),
+                nn.Flatten(1),
                 EqualLinear(channels[4], 1)
             )
         elif self.which_phi == 'avg2':
             self.final_linear = nn.Sequential(
                 nn.AvgPool2d(4),
-                Squeeze(),
+                nn.Flatten(1),
                 EqualLinear(channels[4], channels[4], activation="fused_lrelu"),
                 EqualLinear(channels[4], 1)
             )
 
+    compile_for_inference = compile_for_inference
+
     def forward(self, input):
         out = self.convs(input)
 
-        batch, channel, height, width = out.shape
-        group = min(batch, self.stddev_group)
-        stddev = out.view(
-            group, -1, self.stddev_feat, channel // self.stddev_feat, height, width
-        )
-        stddev = torch.sqrt(stddev.var(0, unbiased=False) + 1e-8)
-        stddev = stddev.mean([2, 3, 4], keepdims=True).squeeze(2)
-        stddev = stddev.repeat(group, 1, height, width)
-        out = torch.cat([out, stddev], 1)
+        group = min(out.shape[0], self.stddev_group)
+        out = minibatch_stddev(out, group, self.stddev_feat)
 
         out = self.final_conv(out)
         out = self.final_linear(out)
@@ -928,22 +1125,22 @@ class Encoder(nn.Module):
             assert(channels[4] == self.latent_full * rep_mul)
             self.final_linear = nn.Sequential(
                 nn.AvgPool2d(4),
-                Squeeze(),
+                nn.Flatten(1),
             )
         elif self.which_phi == 'avg1':
             self.final_linear = nn.Sequential(
                 nn.AvgPool2d(4),
-                Squeeze(),
+                nn.Flatten(1),
                 EqualLinear(channels[4], self.latent_full * rep_mul)
             )
         elif self.which_phi == 'lin1':
             self.final_linear = nn.Sequential(
-                Reshape(),
+                nn.Flatten(1),
                 EqualLinear(channels[4] * 4 * 4, self.latent_full * rep_mul)
             )
         elif self.which_phi == 'lin2':
             self.final_linear = nn.Sequential(
-                Reshape(),
+                nn.Flatten(1),
                 EqualLinear(channels[4] * 4 * 4, channels[4], activation="fused_lrelu"),
                 EqualLinear(channels[4], self.latent_full * rep_mul)
             )
@@ -972,15 +1169,8 @@ class Encoder(nn.Module):
         batch = out.shape[0]
 
         if self.stddev_group > 1:
-            batch, channel, height, width = out.shape
             group = min(batch, self.stddev_group)
-            stddev = out.view(
-                group, -1, self.stddev_feat, channel // self.stddev_feat, height, width
-            )
-            stddev = torch.sqrt(stddev.var(0, unbiased=False) + 1e-8)
-            stddev = stddev.mean([2, 3, 4], keepdims=True).squeeze(2)
-            stddev = stddev.repeat(group, 1, height, width)
-            out = torch.cat([out, stddev], 1)
+            out = minibatch_stddev(out, group, self.stddev_feat)
 
         out = self.final_conv(out)
         # print("self.final_conv: ",out.shape)
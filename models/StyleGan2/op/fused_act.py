@@ -1,13 +1,73 @@
 import os
+import warnings
 
 import torch
 from torch import nn
 from torch.nn import functional as F
 from torch.autograd import Function
+from torch.utils.cpp_extension import load_inline
 
 
 module_path = os.path.dirname(__file__)
 
+_noise_act_cpp_source = (
+    'torch::Tensor fused_noise_act(const torch::Tensor& input, const torch::Tensor& noise, '
+    'const torch::Tensor& weight, const torch::Tensor& bias, double negative_slope, double scale);'
+)
+
+# set STYLEGAN2_CUSTOM_KERNELS=0 (or this flag to False) to never build the
+# inline CUDA extensions and always use the native ops
+custom_kernels_enabled = os.environ.get('STYLEGAN2_CUSTOM_KERNELS', '1') != '0'
+
+_extensions = {}
+
+
+def load_extension(name, cu_file, cpp_source):
+    """JIT-build (once, with nvcc) the inline extension `name` exporting the
+    function `name`, or return None if that failed or is disabled.
+    """
+    if not custom_kernels_enabled:
+        return None
+
+    if name not in _extensions:
+        try:
+            with open(os.path.join(module_path, cu_file)) as f:
+                cuda_source = f.read()
+
+            _extensions[name] = load_inline(
+                name, cpp_sources=[cpp_source], cuda_sources=[cuda_source], functions=[name]
+            )
+
+        except Exception as e:
+            warnings.warn(f'{name} CUDA kernel unavailable, using native path: {e}')
+            _extensions[name] = None
+
+    return _extensions[name]
+
+
+def is_compiling():
+    """Whether torch.compile (dynamo) is tracing the current frame."""
+    is_compiling = getattr(getattr(torch, 'compiler', None), 'is_compiling', None)
+
+    return is_compiling is not None and is_compiling()
+
+
+def use_custom_kernel(*tensors):
+    """Whether the forward-only custom CUDA kernels may be used for `tensors`.
+
+    They have no backward, so they are only used when autograd is not
+    recording through any of `tensors`, and they are opaque to the JIT tracer
+    and torch.compile, which get the native ops instead (and can fuse those
+    themselves). The first eligible call builds the extension with nvcc,
+    see `custom_kernels_enabled` to opt out.
+    """
+    if not custom_kernels_enabled or not tensors[0].is_cuda or torch.jit.is_tracing():
+        return False
+
+    if torch.is_grad_enabled() and any(t.requires_grad for t in tensors):
+        return False
+
+    return not is_compiling()
 
 
 class FusedLeakyReLU(nn.Module):
@@ -32,3 +92,16 @@ def fused_leaky_relu(input, bias, negative_slope=0.2, scale=2 ** 0.5):
         * scale
     )
 
+
+def fused_noise_leaky_relu(input, noise, weight, bias, negative_slope=0.2, scale=2 ** 0.5):
+    """lrelu(input + weight * noise + bias) * scale in a single pass over input.
+
+    noise is [1 or batch, 1, height, width] and weight a one element tensor.
+    """
+    if use_custom_kernel(input, noise, weight, bias):
+        noise_act = load_extension('fused_noise_act', 'fused_noise_act.cu', _noise_act_cpp_source)
+
+        if noise_act is not None:
+            return noise_act.fused_noise_act(input, noise, weight, bias, negative_slope, scale)
+
+    return fused_leaky_relu(input + weight * noise, bias, negative_slope, scale)
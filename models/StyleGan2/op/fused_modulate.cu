@@ -0,0 +1,139 @@
+#include <torch/extension.h>
+
+#include <ATen/AccumulateType.h>
+#include <ATen/cuda/CUDAContext.h>
+#include <c10/cuda/CUDAGuard.h>
+
+#include <cuda.h>
+#include <cuda_runtime.h>
+
+static __device__ __forceinline__ float rsqrt_(float x) { return rsqrtf(x); }
+
+static __device__ __forceinline__ double rsqrt_(double x) { return rsqrt(x); }
+
+template <typename acc_t>
+static __device__ __forceinline__ acc_t warp_reduce_sum(acc_t val) {
+  for (int offset = warpSize / 2; offset > 0; offset /= 2) {
+    val += __shfl_down_sync(0xffffffff, val, offset);
+  }
+
+  return val;
+}
+
+// One block per (batch, out_channel) pair, threads over (in_channel, k, k).
+// out[b, o, i, y, x] = scale * weight[o, i, y, x] * style[b, i] * demod[b, o]
+// With transpose, out is laid out as [b, i, o, y, x] for conv_transpose2d.
+template <typename scalar_t>
+static __global__ void fused_modulate_kernel(scalar_t *out,
+                                             const scalar_t *weight,
+                                             const scalar_t *style, float scale,
+                                             bool demodulate, bool transpose,
+                                             int out_channel, int in_channel,
+                                             int kernel_area) {
+  using acc_t = at::acc_type<scalar_t, true>;
+
+  __shared__ acc_t warp_sums[32];
+  __shared__ acc_t demod;
+
+  const int b = blockIdx.x / out_channel;
+  const int o = blockIdx.x % out_channel;
+  const int n = in_channel * kernel_area;
+
+  const scalar_t *w = weight + (int64_t)o * n;
+  const scalar_t *s = style + (int64_t)b * in_channel;
+
+  acc_t d = 1;
+
+  if (demodulate) {
+    acc_t sum = 0;
+
+    for (int i = threadIdx.x; i < n; i += blockDim.x) {
+      acc_t v = static_cast<acc_t>(w[i]) * scale *
+                static_cast<acc_t>(s[i / kernel_area]);
+      sum += v * v;
+    }
+
+    const int lane = threadIdx.x % warpSize;
+    const int warp = threadIdx.x / warpSize;
+
+    sum = warp_reduce_sum(sum);
+
+    if (lane == 0) {
+      warp_sums[warp] = sum;
+    }
+
+    __syncthreads();
+
+    if (warp == 0) {
+      const int n_warps = (blockDim.x + warpSize - 1) / warpSize;
+      sum = lane < n_warps ? warp_sums[lane] : static_cast<acc_t>(0);
+      sum = warp_reduce_sum(sum);
+
+      if (lane == 0) {
+        demod = rsqrt_(sum + static_cast<acc_t>(1e-8));
+      }
+    }
+
+    __syncthreads();
+
+    d = demod;
+  }
+
+  for (int i = threadIdx.x; i < n; i += blockDim.x) {
+    const int c = i / kernel_area;
+    const int64_t idx =
+        transpose
+            ? (((int64_t)b * in_channel + c) * out_channel + o) * kernel_area +
+                  i % kernel_area
+            : (int64_t)blockIdx.x * n + i;
+
+    out[idx] = static_cast<scalar_t>(static_cast<acc_t>(w[i]) * scale *
+                                     static_cast<acc_t>(s[c]) * d);
+  }
+}
+
+torch::Tensor fused_modulate(const torch::Tensor &weight,
+                             const torch::Tensor &style, double scale,
+                             bool demodulate, bool transpose) {
+  TORCH_CHECK(weight.is_cuda(), "weight must be a CUDA tensor");
+  TORCH_CHECK(style.is_cuda(), "style must be a CUDA tensor");
+  TORCH_CHECK(weight.dim() == 5, "weight must be [1, out, in, k, k]");
+  TORCH_CHECK(style.dim() == 2, "style must be [batch, in]");
+
+  const at::cuda::OptionalCUDAGuard device_guard(device_of(weight));
+
+  auto w = weight.contiguous();
+  auto s = style.to(w.scalar_type()).contiguous();
+
+  const int batch = s.size(0);
+  const int out_channel = w.size(1);
+  const int in_channel = w.size(2);
+  const int kernel_h = w.size(3);
+  const int kernel_w = w.size(4);
+  const int kernel_area = kernel_h * kernel_w;
+
+  TORCH_CHECK(s.size(1) == in_channel, "style does not match weight in_channel");
+
+  auto out = transpose
+                 ? at::empty({batch * in_channel, out_channel, kernel_h, kernel_w},
+                             w.options())
+                 : at::empty({batch * out_channel, in_channel, kernel_h, kernel_w},
+                             w.options());
+
+  const int n = in_channel * kernel_area;
+  const int threads = std::min(1024, ((n + 31) / 32) * 32);
+  auto stream = at::cuda::getCurrentCUDAStream();
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(
+      at::ScalarType::Half, at::ScalarType::BFloat16, w.scalar_type(),
+      "fused_modulate_kernel", [&] {
+        fused_modulate_kernel<scalar_t><<<batch * out_channel, threads, 0, stream>>>(
+            out.data_ptr<scalar_t>(), w.data_ptr<scalar_t>(),
+            s.data_ptr<scalar_t>(), static_cast<float>(scale), demodulate,
+            transpose, out_channel, in_channel, kernel_area);
+      });
+
+  AT_CUDA_CHECK(cudaGetLastError());
+
+  return out;
+}
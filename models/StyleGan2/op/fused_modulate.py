@@ -0,0 +1,56 @@
+import torch
+
+from .fused_act import load_extension, use_custom_kernel
+
+
+_cpp_source = (
+    'torch::Tensor fused_modulate(const torch::Tensor& weight, '
+    'const torch::Tensor& style, double scale, bool demodulate, bool transpose);'
+)
+
+
+def fused_modulate(weight, style, scale, demodulate=True, transpose=False):
+    """Modulate (and optionally demodulate) a [1, out, in, k, k] weight by a
+    [batch, in] style, returning a [batch * out, in, k, k] grouped conv weight,
+    or with transpose a [batch * in, out, k, k] grouped conv_transpose2d weight.
+
+    The CUDA kernel computes the demodulation norm on the fly and writes the
+    final weight once.
+    """
+    if use_custom_kernel(weight, style):
+        fused = load_extension('fused_modulate', 'fused_modulate.cu', _cpp_source)
+
+        if fused is not None:
+            return fused.fused_modulate(weight, style, scale, demodulate, transpose)
+
+    return fused_modulate_native(weight, style, scale, demodulate, transpose)
+
+
+def fused_modulate_native(weight, style, scale, demodulate=True, transpose=False):
+    batch, in_channel = style.shape
+    _, out_channel, _, kernel_h, kernel_w = weight.shape
+
+    if scale != 1:
+        weight = scale * weight
+
+    if transpose:
+        # permute only the shared weight, the per-sample result is then built
+        # directly as [batch, in, out, k, k]
+        weight = weight.transpose(1, 2).contiguous()
+        weight = weight * style.view(batch, in_channel, 1, 1, 1)
+        norm_dims = [1, 3, 4]
+        demod_shape = (batch, 1, out_channel, 1, 1)
+        out_shape = (batch * in_channel, out_channel, kernel_h, kernel_w)
+
+    else:
+        weight = weight * style.view(batch, 1, in_channel, 1, 1)
+        norm_dims = [2, 3, 4]
+        demod_shape = (batch, out_channel, 1, 1, 1)
+        out_shape = (batch * out_channel, in_channel, kernel_h, kernel_w)
+
+    if demodulate:
+        # keep the reduction in fp32 under autocast
+        demod = torch.rsqrt(weight.float().pow(2).sum(norm_dims) + 1e-8).to(weight.dtype)
+        weight = weight * demod.view(*demod_shape)
+
+    return weight.view(*out_shape)
@@ -0,0 +1,83 @@
+#include <torch/extension.h>
+
+#include <ATen/AccumulateType.h>
+#include <ATen/cuda/CUDAContext.h>
+#include <c10/cuda/CUDAGuard.h>
+
+#include <cuda.h>
+#include <cuda_runtime.h>
+
+// out[b, c, y, x] = lrelu(input[b, c, y, x] + weight * noise[b or 0, 0, y, x] + bias[c]) * scale
+template <typename scalar_t>
+static __global__ void fused_noise_act_kernel(
+    scalar_t *out, const scalar_t *input, const scalar_t *noise,
+    const scalar_t *weight, const scalar_t *bias, float negative_slope,
+    float scale, int64_t n, int channel, int64_t area, bool noise_batched) {
+  using acc_t = at::acc_type<scalar_t, true>;
+
+  const acc_t w = static_cast<acc_t>(weight[0]);
+
+  for (int64_t i = blockIdx.x * (int64_t)blockDim.x + threadIdx.x; i < n;
+       i += (int64_t)blockDim.x * gridDim.x) {
+    const int64_t pixel = i % area;
+    const int c = (i / area) % channel;
+    const int64_t b = i / (area * channel);
+    const int64_t noise_idx = noise_batched ? b * area + pixel : pixel;
+
+    acc_t v = static_cast<acc_t>(input[i]) +
+              w * static_cast<acc_t>(noise[noise_idx]) +
+              static_cast<acc_t>(bias[c]);
+    v = v > 0 ? v : v * negative_slope;
+
+    out[i] = static_cast<scalar_t>(v * scale);
+  }
+}
+
+torch::Tensor fused_noise_act(const torch::Tensor &input,
+                              const torch::Tensor &noise,
+                              const torch::Tensor &weight,
+                              const torch::Tensor &bias, double negative_slope,
+                              double scale) {
+  TORCH_CHECK(input.is_cuda(), "input must be a CUDA tensor");
+  TORCH_CHECK(input.dim() == 4, "input must be [batch, channel, height, width]");
+
+  const at::cuda::OptionalCUDAGuard device_guard(device_of(input));
+
+  auto x = input.contiguous();
+  auto z = noise.to(x.scalar_type()).contiguous();
+  auto w = weight.to(x.scalar_type()).contiguous();
+  auto b = bias.to(x.scalar_type()).contiguous();
+
+  const int batch = x.size(0);
+  const int channel = x.size(1);
+  const int64_t area = x.size(2) * x.size(3);
+  const int64_t n = x.numel();
+
+  TORCH_CHECK(z.numel() == area || z.numel() == batch * area,
+              "noise must be [1 or batch, 1, height, width]");
+  TORCH_CHECK(b.numel() == channel, "bias must have one entry per channel");
+
+  auto out = at::empty_like(x);
+
+  if (n == 0) {
+    return out;
+  }
+
+  const int threads = 256;
+  const int blocks = (int)std::min<int64_t>((n + threads - 1) / threads, 65535);
+  auto stream = at::cuda::getCurrentCUDAStream();
+
+  AT_DISPATCH_FLOATING_TYPES_AND2(
+      at::ScalarType::Half, at::ScalarType::BFloat16, x.scalar_type(),
+      "fused_noise_act_kernel", [&] {
+        fused_noise_act_kernel<scalar_t><<<blocks, threads, 0, stream>>>(
+            out.data_ptr<scalar_t>(), x.data_ptr<scalar_t>(),
+            z.data_ptr<scalar_t>(), w.data_ptr<scalar_t>(),
+            b.data_ptr<scalar_t>(), static_cast<float>(negative_slope),
+            static_cast<float>(scale), n, channel, area, z.numel() != area);
+      });
+
+  AT_CUDA_CHECK(cudaGetLastError());
+
+  return out;
+}